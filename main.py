@@ -1,138 +1,538 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import json
+import os
+import re
+import shlex
 import shutil
 import subprocess
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import IO, Any, Deque, Dict, List, NamedTuple, Optional, Tuple
 
 # -------------------- Config defaults --------------------
 DEFAULT_LADDER = [2160, 1440, 1080, 720, 480]
-# H.264 targets (VBV) and CRF per height
+# H.264 targets (VBV), CRF and x264 preset per height (small rungs: faster presets, little quality cost)
 H264_PARAMS = {
-    2160: dict(br="12000k", maxrate="12840k", bufsize="24000k", crf=19),
-    1440: dict(br="7000k",  maxrate="7490k",  bufsize="14000k", crf=20),
-    1080: dict(br="5000k",  maxrate="5350k",  bufsize="10000k", crf=20),
-    720:  dict(br="2800k",  maxrate="2996k",  bufsize="5600k",  crf=21),
-    480:  dict(br="1400k",  maxrate="1498k",  bufsize="2800k",  crf=22),
+    2160: dict(br="12000k", maxrate="12840k", bufsize="24000k", crf=19, preset="slow"),
+    1440: dict(br="7000k",  maxrate="7490k",  bufsize="14000k", crf=20, preset="medium"),
+    1080: dict(br="5000k",  maxrate="5350k",  bufsize="10000k", crf=20, preset="medium"),
+    720:  dict(br="2800k",  maxrate="2996k",  bufsize="5600k",  crf=21, preset="fast"),
+    480:  dict(br="1400k",  maxrate="1498k",  bufsize="2800k",  crf=22, preset="faster"),
 }
+H264_DEFAULT = dict(br="2500k", maxrate="2680k", bufsize="5000k", crf=21, preset="medium")
+# VBV (option, value) pairs per height, built once; the stream specifier is appended per output
+H264_VBV = {h: (("-b", p["br"]), ("-maxrate", p["maxrate"]), ("-bufsize", p["bufsize"]))
+            for h, p in H264_PARAMS.items()}
+H264_VBV_DEFAULT = (("-b", H264_DEFAULT["br"]), ("-maxrate", H264_DEFAULT["maxrate"]), ("-bufsize", H264_DEFAULT["bufsize"]))
 # AV1 CRF per height (libaom-av1/libsvtav1)
 AV1_CRF = {2160:30, 1440:31, 1080:32, 720:33, 480:34}
+# AV1 speed per height: libaom cpu-used and SVT-AV1 preset (higher = faster); the large rungs keep
+# the old global values (cpu-used 6, preset 8), only the small ones are sped up
+AV1_CPU_USED = {2160:6, 1440:6, 1080:7, 720:8, 480:8}
+SVT_PRESET   = {2160:8, 1440:8, 1080:9, 720:10, 480:11}
+# Per-title CRF shift (--per-title): kbps of the 540p probe encode at the reference complexity,
+# kbps per CRF step, and the largest shift applied to the H.264 and AV1 CRF tables
+PER_TITLE_REF_KBPS  = 1000
+PER_TITLE_STEP_KBPS = 250
+PER_TITLE_MAX_SHIFT = 4
+# Hardware encoders per --hw backend (VideoToolbox has no AV1 encoder)
+HW_ENCODERS = {
+    "nvenc": dict(h264="h264_nvenc",        av1="av1_nvenc"),
+    "qsv":   dict(h264="h264_qsv",          av1="av1_qsv"),
+    "vt":    dict(h264="h264_videotoolbox", av1=None),
+}
+# x264 preset names -> NVENC p1 (fastest) .. p7 (best) / QSV presets
+NVENC_PRESET = {"ultrafast":"p1", "superfast":"p1", "veryfast":"p2", "faster":"p3", "fast":"p4",
+                "medium":"p5", "slow":"p6", "slower":"p7", "veryslow":"p7"}
+QSV_PRESET   = {"ultrafast":"veryfast", "superfast":"veryfast"}
+# Scale filter per backend (see build_filter)
+SCALERS = {
+    "scale":      "scale=-2:{h}:flags=bicubic",
+    "zscale":     "zscale=w=-2:h={h}:filter=lanczos",
+    "scale_cuda": "scale_cuda=-2:{h}:format=nv12",  # 8-bit 4:2:0 for NVENC, like -pix_fmt yuv420p
+}
+# Tool/encoder/filter detection cache (survives across runs)
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home()/".cache")/"2mpeg-dash"
+# stderr lines kept from each ffmpeg/packager run for error reports
+STDERR_TAIL = 200
+# Input-side options placed before every -i: MP4 headers carry all we need, so cap probing (default 5 MB / 5 s)
+INPUT_OPTS = ["-probesize", "1000000", "-analyzeduration", "1000000", "-fflags", "+fastseek"]
+# Leading options for every ffmpeg call: never poll stdin for keys, no banner, warnings and up only
+# (the progress line is still printed below info level)
+FFMPEG_QUIET = ["-nostdin", "-hide_banner", "-loglevel", "warning"]
+# NVDEC decode into GPU memory (all-NVENC runs, see use_gpu_frames)
+CUDA_DECODE = ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
 
 # -------------------- Utils --------------------
+@lru_cache(maxsize=None)
 def have(tool: str) -> bool:
     return shutil.which(tool) is not None
 
+def load_cache(name: str, key: str) -> Optional[Dict[str, Any]]:
+    """Return CACHE_DIR/<name> if it was written for key."""
+    try:
+        cached = json.loads((CACHE_DIR/name).read_text())
+        return cached if cached.get("key") == key else None
+    except (OSError, ValueError):
+        return None
+
+def save_cache(name: str, key: str, data: Dict[str, Any]) -> None:
+    """Write CACHE_DIR/<name> atomically (temp file + rename): concurrent runs never read a partial file."""
+    try:
+        ensure_dir(CACHE_DIR)
+        tmp = CACHE_DIR/f"{name}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(dict(key=key, **data)))
+        os.replace(tmp, CACHE_DIR/name)
+    except OSError:
+        pass
+
+def ffmpeg_listing(ffmpeg: str, what: str) -> List[str]:
+    """Names from `ffmpeg -encoders` / `ffmpeg -filters`: the second column, skipping the legend."""
+    out = subprocess.run([ffmpeg,"-nostdin","-hide_banner",what], stdin=subprocess.DEVNULL,
+                         capture_output=True, text=True).stdout
+    rows = [line.split() for line in out.splitlines()]
+    return [r[1] for r in rows if len(r) > 1 and r[1] != "="]
+
+def hw_encoder_works(name: str) -> bool:
+    """A listed hardware encoder may still lack a device or driver: try a one-frame encode with the
+    rate control the real encodes use."""
+    hw = next(b for b, e in HW_ENCODERS.items() if name in (e["h264"], e["av1"]))
+    cmd = ["ffmpeg","-nostdin","-hide_banner","-loglevel","error",
+           "-f","lavfi","-i","color=black:s=256x256:d=0.1","-frames:v","1",
+           "-pix_fmt","nv12","-c:v",name,*hw_quality(hw, 23, ":v"),"-f","null","-"]
+    return subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True).returncode == 0
+
+class Encoders(NamedTuple):
+    h264: List[str]  # H.264 encoders this ffmpeg lists, e.g. ["libx264", "h264_nvenc"]
+    av1: List[str]   # AV1 encoders this ffmpeg lists, e.g. ["libsvtav1", "libaom-av1"]
+
+@lru_cache(maxsize=None)
+def detect_encoders() -> Encoders:
+    """Return the H.264/AV1 encoders this ffmpeg lists.
+
+    The `ffmpeg -encoders` listing is cached like has_filter(). Hardware encoders are only listed
+    here; main() test-encodes (hw_encoder_works) just the backend it is about to pick, since a GPU
+    or driver can come and go without ffmpeg changing.
+    """
+    listed = set(ffmpeg_names("encoders"))
+    return Encoders(
+        h264=[n for n in ["libx264", *[e["h264"] for e in HW_ENCODERS.values()]] if n in listed],
+        av1=[n for n in ["libsvtav1", "libaom-av1", *[e["av1"] for e in HW_ENCODERS.values() if e["av1"]]]
+             if n in listed],
+    )
+
+def has_filter(name: str) -> bool:
+    """Whether this ffmpeg has the given filter (e.g. zscale)."""
+    return name in ffmpeg_names("filters")
+
+def ffmpeg_names(what: str) -> List[str]:
+    """`ffmpeg -encoders` / `-filters` names ("encoders"/"filters").
+
+    Memoized per process and persisted to CACHE_DIR/<what>.json, keyed on the ffmpeg binary's
+    real path and mtime, so the listing only runs again when ffmpeg changes.
+    """
+    ffmpeg = os.path.realpath(shutil.which("ffmpeg"))
+    return probe_names(ffmpeg, os.stat(ffmpeg).st_mtime_ns, what)
+
+@lru_cache(maxsize=None)
+def probe_names(ffmpeg: str, mtime_ns: int, what: str) -> List[str]:
+    key = f"{ffmpeg}|{mtime_ns}"
+    cached = load_cache(f"{what}.json", key)
+    if cached and what in cached:
+        return cached[what]
+    names = ffmpeg_listing(ffmpeg, f"-{what}")
+    save_cache(f"{what}.json", key, {what: names})
+    return names
+
+class Proc(NamedTuple):
+    popen: subprocess.Popen
+    reader: threading.Thread
+    tail: Deque[str]
+
+def tee_stderr(stream: IO[bytes], tail: Deque[str]) -> None:
+    """Mirror a child's stderr to ours as it arrives and keep its last lines in tail.
+
+    Only newline-terminated lines go to tail: ffmpeg redraws its progress line with "\r", and those
+    updates would otherwise push the actual warnings out.
+    """
+    pending = b""
+    for chunk in iter(lambda: stream.read1(1 << 16), b""):
+        sys.stderr.buffer.write(chunk)
+        sys.stderr.buffer.flush()
+        *lines, pending = (pending + chunk).split(b"\n")
+        # a progress line followed by a message without a newline in between: keep the message
+        # (the trailing "\r" of CRLF line ends, as on Windows, is not a redraw)
+        lines = [l.rstrip(b"\r").rsplit(b"\r", 1)[-1] for l in lines]
+        tail.extend(l.decode(errors="replace") for l in lines if l.strip())
+
+def run_async(cmd: List[str], cwd: Optional[Path]=None, cpus: Optional[List[int]]=None) -> Proc:
+    """Start cmd without waiting; optionally pin the child to the given CPUs (Linux only).
+
+    The child's stderr is streamed to ours (live progress) and its last STDERR_TAIL lines are kept
+    for the error raised by wait_all().
+    """
+    print(">>", shlex.join(cmd))
+    p = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=1 << 20)
+    # Pin after the fact: preexec_fn is unsafe once reader threads exist (the child may deadlock
+    # before exec); ffmpeg's worker threads are started later and inherit the mask
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(p.pid, cpus)
+        except OSError:
+            pass
+    tail: Deque[str] = deque(maxlen=STDERR_TAIL)
+    reader = threading.Thread(target=tee_stderr, args=(p.stderr, tail), daemon=True)
+    reader.start()
+    return Proc(p, reader, tail)
+
+def wait_all(procs: List[Proc]) -> None:
+    """Wait for every child; on the first non-zero exit terminate the others and raise with its tail."""
+    running = list(procs)
+    failed = None
+    while running and failed is None:
+        for p in [p for p in running if p.popen.poll() is not None]:
+            running.remove(p)
+            if p.popen.returncode and failed is None:
+                failed = p
+        if running and failed is None:
+            time.sleep(0.2)
+    for p in running:
+        p.popen.terminate()
+    for p in procs:
+        p.popen.wait()
+        p.reader.join()
+    if failed:
+        raise RuntimeError(f"{failed.popen.args[0]} exited with status {failed.popen.returncode}:\n" + "\n".join(failed.tail))
+
 def run(cmd: List[str], cwd: Optional[Path]=None) -> None:
-    print(">>", " ".join(cmd))
-    subprocess.run(cmd, check=True, cwd=cwd)
+    wait_all([run_async(cmd, cwd=cwd)])
 
-def ffprobe_value(src: Path, entries: List[str], stream_sel: str) -> List[str]:
-    cmd = [
-        "ffprobe","-v","error",
-        "-select_streams",stream_sel,
+def split_cpus(n: int) -> List[Optional[List[int]]]:
+    """Split the CPUs available to us into n contiguous sets (None = no pinning)."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if n < 2 or len(cpus) < n:
+        return [None] * n
+    size = len(cpus) // n
+    return [cpus[i*size:(i+1)*size] if i < n-1 else cpus[i*size:] for i in range(n)]
+
+def ffprobe_json(src: Path, entries: List[str], stream_sel: Optional[str]=None) -> Dict[str, Any]:
+    """Run ffprobe once with -of json and return the parsed output."""
+    cmd = ["ffprobe","-hide_banner","-v","error"]
+    if stream_sel:
+        cmd += ["-select_streams",stream_sel]
+    cmd += [
         "-show_entries",",".join(entries),
-        "-of","default=nw=1:nk=1",
-        str(src)
+        "-of","json",
+        *INPUT_OPTS, str(src)
     ]
-    out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.strip().splitlines()
-    return [x.strip() for x in out if x.strip()]
+    return json.loads(subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                     text=True, check=True).stdout)
+
+def parse_rate(frac: str) -> float:
+    """Parse an ffprobe rate ("30000/1001", "25"); "0/0" and other degenerate values raise."""
+    fps = float(Fraction(frac))
+    if fps <= 0:
+        raise ValueError(f"invalid frame rate: {frac}")
+    return fps
+
+def probe_all(src: Path, cache_dir: Optional[Path]=None) -> Dict[str, Any]:
+    """Return {"height", "fps", "has_audio"} for src from a single ffprobe run.
+
+    Results are cached as JSON in cache_dir, keyed by (path, mtime, size), so re-runs skip ffprobe.
+    """
+    st = src.stat()
+    key = hashlib.sha1(f"{src.resolve()}|{st.st_mtime_ns}|{st.st_size}".encode()).hexdigest()
+    cache_file = cache_dir/f"{key}.json" if cache_dir else None
+    if cache_file and cache_file.exists():
+        try:
+            return json.loads(cache_file.read_text())
+        except (OSError, ValueError):
+            pass
 
-def get_src_height(src: Path) -> int:
     try:
-        vals = ffprobe_value(src, ["stream=height"], "v:0")
-        return int(vals[0])
+        streams = ffprobe_json(src, ["stream=index,codec_type,height,avg_frame_rate"]).get("streams", [])
     except Exception:
-        return 1080
+        return dict(height=1080, fps=25.0, has_audio=False)
 
-def get_avg_fps(src: Path) -> float:
+    video = next((x for x in streams if x.get("codec_type") == "video"), {})
     try:
-        vals = ffprobe_value(src, ["stream=avg_frame_rate"], "v:0")
-        frac = vals[0]
-        if "/" in frac:
-            num, den = frac.split("/")
-            den = float(den) if float(den) != 0 else 1.0
-            return float(num)/den
-        return float(frac)
+        height = int(video["height"])
     except Exception:
-        return 25.0
-
-def has_audio(src: Path) -> bool:
+        height = 1080
     try:
-        vals = ffprobe_value(src, ["stream=index"], "a")
-        return len(vals) > 0
+        fps = parse_rate(video["avg_frame_rate"])
     except Exception:
-        return False
+        fps = 25.0
+    meta = dict(height=height, fps=fps, has_audio=any(x.get("codec_type") == "audio" for x in streams))
+
+    if cache_file:
+        ensure_dir(cache_file.parent)
+        cache_file.write_text(json.dumps(meta))
+    return meta
 
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 # -------------------- Encoding --------------------
-def build_filter(heights: List[int], prefix: str) -> Tuple[str, List[str]]:
-    """Return filter_complex and output labels for scaled streams."""
-    n = len(heights)
-    split_labels = [f"{prefix}{i}" for i in range(n)]
-    split = "[0:v]split=" + str(n) + "".join([f"[{l}]" for l in split_labels]) + ";"
-    scales = []
-    out_labels = []
-    for i, h in enumerate(heights):
-        out_label = f"{prefix}{h}"
-        scales.append(f"[{split_labels[i]}]scale=-2:{h}:flags=bicubic[{out_label}]")
-        out_labels.append(out_label)
-    filter_complex = split + "".join(s + ";" for s in scales)
+def build_filter(heights: List[int], prefixes: List[str], gpu: bool=False) -> Tuple[str, Dict[str, List[str]]]:
+    """Return filter_complex and, per prefix, the output labels for scaled streams.
+
+    Scales are cascaded: the source is scaled to the largest rung only, and each rung is the input
+    of the next smaller one (src→2160→1440→…), so no rung is downscaled from full resolution.
+    Every scaled stream is split into one copy per prefix plus the feed for the next rung
+    (a filter output label can only be mapped once).
+
+    Scaler: scale_cuda for CUDA frames (gpu=True), else zscale (zimg, SIMD, lanczos) when this
+    ffmpeg has it, else swscale bicubic.
+    """
+    scaler = "scale_cuda" if gpu else ("zscale" if has_filter("zscale") else "scale")
+    base = "".join(prefixes)
+    hs = sorted(set(heights), reverse=True)
+    chains = []
+    feed = "0:v"
+    for i, h in enumerate(hs):
+        outs = [f"{p}{h}" for p in prefixes]
+        if i < len(hs) - 1:
+            outs.append(f"{base}n{hs[i+1]}")
+        chain = f"[{feed}]" + SCALERS[scaler].format(h=h)
+        if len(outs) > 1:
+            chain += f",split={len(outs)}"
+        chains.append(chain + "".join(f"[{o}]" for o in outs))
+        feed = outs[-1]
+    filter_complex = ";".join(chains)
+    out_labels = {p: [f"{p}{h}" for h in heights] for p in prefixes}
     return filter_complex, out_labels
 
-def encode_h264(src: Path, outdir: Path, heights: List[int], gop: int, preset: str) -> None:
-    ensure_dir(outdir)
-    filt, out_labels = build_filter(heights, "s")
-    args = ["ffmpeg","-y","-i",str(src),"-filter_complex",filt]
-    for h, label in zip(heights, out_labels):
-        p = H264_PARAMS.get(h, dict(br="2500k", maxrate="2680k", bufsize="5000k", crf=21))
-        args += [
-            "-map", f"[{label}]",
-            "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p",
-            "-crf", str(p["crf"]), "-profile:v", "high",
-            "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
-            "-b:v", p["br"], "-maxrate", p["maxrate"], "-bufsize", p["bufsize"],
-            "-movflags", "+faststart",
-            str(outdir / f"h264_{h}.mp4")
+def ffmpeg_input(src: Path, gpu: bool=False) -> List[str]:
+    """ffmpeg command head up to the input; gpu=True keeps decoded frames on the GPU (CUDA)."""
+    hwdec = CUDA_DECODE if gpu else []
+    return ["ffmpeg",*FFMPEG_QUIET,"-y",*hwdec,*INPUT_OPTS,"-i",str(src)]
+
+def hw_quality(hw: str, crf: int, sfx: str) -> List[str]:
+    """Translate a CRF value into the quality knob of a hardware encoder."""
+    if hw == "nvenc":
+        return [f"-rc{sfx}", "vbr", f"-cq{sfx}", str(crf)]
+    if hw == "qsv":
+        return [f"-global_quality{sfx}", str(crf)]
+    # VideoToolbox: constant quality (-q:v) only exists on Apple Silicon, so stay bitrate-driven
+    # (the rung's -b/-maxrate/-bufsize)
+    return []
+
+def keyframe_opts(sfx: str, gop: int, seg_dur: int) -> List[str]:
+    """Force a keyframe at every segment boundary (identical segment timelines across all rungs
+    and codecs); -g is only a cap."""
+    return [f"-force_key_frames{sfx}", f"expr:gte(t,n_forced*{seg_dur})", f"-g{sfx}", str(gop)]
+
+def h264_opts(h: int, sfx: str, gop: int, seg_dur: int, preset: Optional[str], threads: int=0,
+              hw: str="none", gpu: bool=False, crf_shift: int=0) -> List[str]:
+    """H.264 options for one rung; sfx is the output stream specifier (":v" or ":v:N").
+
+    preset overrides the per-rung H264_PARAMS preset when given; crf_shift is added to its CRF
+    (--per-title). hw selects a hardware encoder (see HW_ENCODERS) instead of libx264; gpu=True
+    means the input frames are CUDA frames.
+    """
+    p = H264_PARAMS.get(h, H264_DEFAULT)
+    preset = preset or p["preset"]
+    crf = p["crf"] + crf_shift
+    vbv = [a for opt, val in H264_VBV.get(h, H264_VBV_DEFAULT) for a in (opt + sfx, val)]
+    if hw == "none":
+        thr = [f"-threads{sfx}", str(threads)] if threads > 0 else []
+        return [
+            f"-c{sfx}", "libx264", *thr, f"-preset{sfx}", preset, f"-pix_fmt{sfx}", "yuv420p",
+            f"-crf{sfx}", str(crf), f"-profile{sfx}", "high",
+            *keyframe_opts(sfx, gop, seg_dur), *vbv,
+        ]
+    args = [f"-c{sfx}", HW_ENCODERS[hw]["h264"]]
+    if hw == "nvenc":
+        args += [f"-preset{sfx}", NVENC_PRESET.get(preset, "p5"), f"-forced-idr{sfx}", "1"]
+    elif hw == "qsv":
+        args += [f"-preset{sfx}", QSV_PRESET.get(preset, preset), f"-forced_idr{sfx}", "1"]
+    if not gpu:
+        args += [f"-pix_fmt{sfx}", "nv12" if hw == "qsv" else "yuv420p"]
+    return args + [
+        *hw_quality(hw, crf, sfx), f"-profile{sfx}", "high",
+        *keyframe_opts(sfx, gop, seg_dur), *vbv,
+    ]
+
+def av1_opts(h: int, sfx: str, gop: int, seg_dur: int, encoder: str, cpu_used: Optional[int], threads: int=0,
+             gpu: bool=False, crf_shift: int=0) -> List[str]:
+    """AV1 options for one rung; sfx is the output stream specifier.
+
+    encoder is "svt", "aom" or a HW_ENCODERS backend with an AV1 encoder ("nvenc", "qsv").
+    cpu_used overrides the per-rung AV1_CPU_USED value (libaom only) when given; crf_shift is added
+    to the AV1_CRF value. threads caps the encoder's threads (-threads; SVT-AV1 takes it as lp=,
+    its logical-processor knob).
+    """
+    crf = AV1_CRF.get(h, 32) + crf_shift
+    thr = [f"-threads{sfx}", str(threads)] if threads > 0 else []
+    if encoder == "svt":
+        lp = f":lp={threads}" if threads > 0 else ""
+        return [
+            f"-c{sfx}", "libsvtav1", f"-pix_fmt{sfx}", "yuv420p",
+            f"-crf{sfx}", str(crf), *keyframe_opts(sfx, gop, seg_dur),
+            f"-svtav1-params{sfx}", f"keyint={gop}:enable-overlays=0{lp}",
+            f"-preset{sfx}", str(SVT_PRESET.get(h, 8)),
         ]
-    run(args)
+    if encoder in HW_ENCODERS:
+        args = [f"-c{sfx}", HW_ENCODERS[encoder]["av1"]]
+        if not gpu:
+            args += [f"-pix_fmt{sfx}", "nv12" if encoder == "qsv" else "yuv420p"]
+        if encoder == "nvenc":
+            # -b 0: pure CQ, no NVENC default bitrate (2 Mbit/s) capping the large rungs
+            args += [f"-forced-idr{sfx}", "1", f"-b{sfx}", "0"]
+        elif encoder == "qsv":
+            args += [f"-forced_idr{sfx}", "1"]
+        return args + [*hw_quality(encoder, crf, sfx), *keyframe_opts(sfx, gop, seg_dur)]
+    return [
+        f"-c{sfx}", "libaom-av1", *thr, f"-pix_fmt{sfx}", "yuv420p",
+        f"-crf{sfx}", str(crf), f"-b{sfx}", "0",
+        *keyframe_opts(sfx, gop, seg_dur), f"-row-mt{sfx}", "1", f"-cpu-used{sfx}", str(AV1_CPU_USED.get(h, 6) if cpu_used is None else cpu_used),
+        f"-tile-columns{sfx}", "1", f"-tile-rows{sfx}", "1",
+    ]
 
-def encode_av1(src: Path, outdir: Path, heights: List[int], gop: int, encoder: str, cpu_used: int) -> None:
+def audio_opts(aac_bitrate: str) -> List[str]:
+    """Stereo AAC for the first audio track; it bypasses the video filter graph."""
+    return ["-map", "0:a:0", "-c:a", "aac", "-b:a", aac_bitrate, "-ac", "2"]
+
+def h264_output(label: str, h: int, outdir: Path, gop: int, seg_dur: int, preset: Optional[str], threads: int=0,
+                hw: str="none", gpu: bool=False, crf_shift: int=0) -> List[str]:
+    return ["-map", f"[{label}]", *h264_opts(h, ":v", gop, seg_dur, preset, threads, hw, gpu, crf_shift),
+            "-movflags", "+faststart", str(outdir / f"h264_{h}.mp4")]
+
+def av1_output(label: str, h: int, outdir: Path, gop: int, seg_dur: int, encoder: str, cpu_used: Optional[int], threads: int=0,
+               gpu: bool=False, crf_shift: int=0) -> List[str]:
+    return ["-map", f"[{label}]", *av1_opts(h, ":v", gop, seg_dur, encoder, cpu_used, threads, gpu, crf_shift),
+            "-movflags", "+faststart", str(outdir / f"av1_{h}.mp4")]
+
+def use_gpu_frames(hw: str, encoder: str, src: Path) -> bool:
+    """Decode+scale on the GPU only when every encoder in the run is NVENC (frames never leave the GPU)
+    and NVDEC can decode src."""
+    return hw == "nvenc" and encoder in ("none", "nvenc") and cuda_decode_works(src)
+
+@lru_cache(maxsize=None)
+def cuda_decode_works(src: Path) -> bool:
+    """Decode and scale one frame of src on the GPU. When NVDEC lacks the codec/profile ffmpeg falls
+    back to system-memory frames, which scale_cuda then rejects."""
+    cmd = ["ffmpeg","-nostdin","-hide_banner","-loglevel","error",*CUDA_DECODE,*INPUT_OPTS,"-i",str(src),
+           "-frames:v", "1", "-vf", SCALERS["scale_cuda"].format(h=240), "-f", "null", "-"]
+    ok = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True).returncode == 0
+    if not ok:
+        print(f"-- [{src.stem}] NVDEC cannot decode this source, decoding and scaling on the CPU")
+    return ok
+
+def encode_h264(src: Path, outdir: Path, heights: List[int], gop: int, seg_dur: int, preset: Optional[str], threads: int=0,
+                hw: str="none", crf_shift: int=0) -> List[str]:
+    """Return the ffmpeg command encoding the H.264 ladder (one run, shared scaling graph)."""
     ensure_dir(outdir)
-    filt, out_labels = build_filter(heights, "t")
-    args = ["ffmpeg","-y","-i",str(src),"-filter_complex",filt]
-    for h, label in zip(heights, out_labels):
-        crf = AV1_CRF.get(h, 32)
-        if encoder == "svt":
-            args += [
-                "-map", f"[{label}]",
-                "-c:v", "libsvtav1", "-pix_fmt", "yuv420p",
-                "-crf", str(crf), "-g", str(gop),
-                "-preset", "8",
-                "-movflags", "+faststart",
-                str(outdir / f"av1_{h}.mp4")
-            ]
-        else:
-            args += [
-                "-map", f"[{label}]",
-                "-c:v", "libaom-av1", "-pix_fmt", "yuv420p",
-                "-crf", str(crf), "-b:v", "0",
-                "-g", str(gop), "-row-mt", "1", "-cpu-used", str(cpu_used),
-                "-tile-columns", "1", "-tile-rows", "1",
-                "-movflags", "+faststart",
-                str(outdir / f"av1_{h}.mp4")
-            ]
-    run(args)
-
-def extract_audio(src: Path, out_m4a: Path, aac_bitrate: str) -> Optional[Path]:
-    if not has_audio(src):
-        return None
-    ensure_dir(out_m4a.parent)
-    run(["ffmpeg","-y","-i",str(src),"-vn","-c:a","aac","-b:a",aac_bitrate,"-ac","2",str(out_m4a)])
-    return out_m4a
+    gpu = use_gpu_frames(hw, "none", src)
+    filt, out_labels = build_filter(heights, ["s"], gpu)
+    args = [*ffmpeg_input(src, gpu),"-filter_complex",filt]
+    for h, label in zip(heights, out_labels["s"]):
+        args += h264_output(label, h, outdir, gop, seg_dur, preset, threads, hw, gpu, crf_shift)
+    return args
+
+def encode_av1(src: Path, outdir: Path, heights: List[int], gop: int, seg_dur: int, encoder: str, cpu_used: Optional[int], threads: int=0,
+               crf_shift: int=0) -> List[str]:
+    """Return the ffmpeg command encoding the AV1 ladder (one run, shared scaling graph)."""
+    ensure_dir(outdir)
+    gpu = use_gpu_frames(encoder, encoder, src)
+    filt, out_labels = build_filter(heights, ["t"], gpu)
+    args = [*ffmpeg_input(src, gpu),"-filter_complex",filt]
+    for h, label in zip(heights, out_labels["t"]):
+        args += av1_output(label, h, outdir, gop, seg_dur, encoder, cpu_used, threads, gpu, crf_shift)
+    return args
+
+def encode_all(src: Path, v264_dir: Path, vav1_dir: Path, heights: List[int], gop: int, seg_dur: int,
+               preset: Optional[str], encoder: str, cpu_used: Optional[int], threads: int=0,
+               hw: str="none", crf_shift: int=0) -> List[str]:
+    """Return one ffmpeg command encoding both ladders: the source is decoded and scaled once."""
+    ensure_dir(v264_dir); ensure_dir(vav1_dir)
+    gpu = use_gpu_frames(hw, encoder, src)
+    filt, out_labels = build_filter(heights, ["s", "t"], gpu)
+    args = [*ffmpeg_input(src, gpu),"-filter_complex",filt]
+    for h, label in zip(heights, out_labels["s"]):
+        args += h264_output(label, h, v264_dir, gop, seg_dur, preset, threads, hw, gpu, crf_shift)
+    for h, label in zip(heights, out_labels["t"]):
+        args += av1_output(label, h, vav1_dir, gop, seg_dur, encoder, cpu_used, threads, gpu, crf_shift)
+    return args
+
+def encode_dash(src: Path, outdash: Path, heights: List[int], gop: int, seg_dur: int,
+                preset: Optional[str], encoder: str, cpu_used: Optional[int], audio_bitrate: Optional[str],
+                threads: int=0, hw: str="none", crf_shift: int=0) -> List[str]:
+    """Return one ffmpeg command that encodes every rung and writes manifest.mpd + CMAF segments
+    directly (dash muxer), so no intermediate MP4s and no second packaging pass are needed.
+
+    Representations are numbered by output stream (H.264 rungs, then AV1 rungs, then audio) and
+    each gets its own directory: <outdash>/<N>/init.mp4, <outdash>/<N>/seg_<k>.m4s.
+    encoder="none" skips the AV1 ladder; audio_bitrate=None skips audio.
+    """
+    prefixes = ["s"] if encoder == "none" else ["s", "t"]
+    gpu = use_gpu_frames(hw, encoder, src)
+    filt, out_labels = build_filter(heights, prefixes, gpu)
+    args = [*ffmpeg_input(src, gpu),"-filter_complex",filt]
+    idx = 0
+    sets = []
+    for prefix in prefixes:
+        streams = []
+        for h, label in zip(heights, out_labels[prefix]):
+            sfx = f":v:{idx}"
+            if prefix == "s":
+                args += ["-map", f"[{label}]", *h264_opts(h, sfx, gop, seg_dur, preset, threads, hw, gpu, crf_shift)]
+            else:
+                args += ["-map", f"[{label}]", *av1_opts(h, sfx, gop, seg_dur, encoder, cpu_used, threads, gpu, crf_shift)]
+            streams.append(str(idx))
+            idx += 1
+        sets.append(f"id={len(sets)},streams={','.join(streams)}")
+    if audio_bitrate:
+        args += audio_opts(audio_bitrate)
+        sets.append(f"id={len(sets)},streams=a")
+        idx += 1
+    for n in range(idx):
+        ensure_dir(outdash/str(n))
+    args += [
+        "-f", "dash",
+        "-seg_duration", str(seg_dur),
+        "-use_template", "1", "-use_timeline", "1",
+        "-dash_segment_type", "mp4",
+        "-init_seg_name", "$RepresentationID$/init.mp4",
+        "-media_seg_name", "$RepresentationID$/seg_$Number$.m4s",
+        "-adaptation_sets", " ".join(sets),
+        str(outdash/"manifest.mpd")
+    ]
+    return args
+
+def per_title_shift(src: Path, vstats: Path, threads: int=0) -> int:
+    """CRF shift for src from a cheap pre-analysis (--per-title).
+
+    A 540p x264 veryfast CRF 28 encode (discarded, only its -vstats kept) gives the average bitrate
+    the content needs at fixed quality: a complexity proxy C. Complex content (C above
+    PER_TITLE_REF_KBPS) gets higher CRFs (its extra bits would mostly hit the rung's VBV cap
+    anyway), easy content lower ones: one step per PER_TITLE_STEP_KBPS, clipped to
+    ±PER_TITLE_MAX_SHIFT.
+    """
+    ensure_dir(vstats.parent)
+    thr = ["-threads", str(threads)] if threads > 0 else []
+    run([*ffmpeg_input(src), "-an", "-vf", "scale=-2:540",
+         "-c:v", "libx264", *thr, "-preset", "veryfast", "-crf", "28",
+         "-vstats_file", str(vstats), "-f", "null", "-"])
+    m = re.findall(r"avg_br=\s*([\d.]+)kbits/s", vstats.read_text())
+    if not m:
+        raise RuntimeError(f"no bitrate in {vstats}")
+    shift = round((float(m[-1]) - PER_TITLE_REF_KBPS) / PER_TITLE_STEP_KBPS)
+    return max(-PER_TITLE_MAX_SHIFT, min(PER_TITLE_MAX_SHIFT, shift))
 
 # -------------------- Packaging --------------------
 def package_shaka(outdash: Path, seg_dur: int,
@@ -185,6 +585,132 @@ def package_mp4box(outdash: Path, seg_dur: int,
         *args
     ])
 
+# -------------------- Pipeline --------------------
+def run_state(src: Path, args: argparse.Namespace, ladder: List[int], av1_enc: str, hw: str) -> Dict[str, Any]:
+    """Everything that determines the output for src; if any of it changes the source is re-encoded.
+
+    The saved state also records the per-title crf_shift; it follows from the above, so
+    is_up_to_date() ignores it.
+    """
+    st = src.stat()
+    tables = json.dumps([H264_PARAMS, AV1_CRF, AV1_CPU_USED, SVT_PRESET,
+                         PER_TITLE_REF_KBPS, PER_TITLE_STEP_KBPS, PER_TITLE_MAX_SHIFT], sort_keys=True)
+    return dict(
+        src_size=st.st_size, src_mtime=st.st_mtime_ns,
+        ladder=ladder, encoder=[hw, av1_enc], seg=args.seg, packager=args.packager,
+        settings=[args.preset264, args.cpu_used, args.audio_bitrate, args.per_title],
+        crf_table_hash=hashlib.sha1(tables.encode()).hexdigest(),
+    )
+
+def save_state(state_file: Path, state: Dict[str, Any]) -> None:
+    """Write state atomically (temp file + rename): a crash never leaves a partial .state.json."""
+    ensure_dir(state_file.parent)
+    tmp = state_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, state_file)
+
+def is_up_to_date(src: Path, manifest: Path, state_file: Path, state: Dict[str, Any]) -> bool:
+    try:
+        if manifest.stat().st_mtime < src.stat().st_mtime:
+            return False
+        saved = json.loads(state_file.read_text())
+        saved.pop("crf_shift", None)
+        return saved == state
+    except (OSError, ValueError):
+        return False
+
+def process_one(src: Path, args: argparse.Namespace, packager: str, av1_enc: str, hw: str="none") -> None:
+    """Encode and package a single source (runs in a worker process when --jobs > 1)."""
+    base = src.stem
+    meta = probe_all(src, Path(args.work)/".probe_cache")
+    gop = max(1, round(meta["fps"]*args.seg))
+    h_src = meta["height"]
+
+    # choose ladder entries
+    ladder = [h for h in DEFAULT_LADDER if h <= h_src and (args.max_height == 0 or h <= args.max_height)]
+    if not ladder:
+        ladder = [h_src]
+
+    work_dir = Path(args.work)/base
+    outdash  = Path(args.out)/base/"dash"
+    manifest = outdash/"manifest.mpd"
+
+    # Skip sources whose manifest is newer than the source and was built with the same settings
+    state = run_state(src, args, ladder, av1_enc, hw)
+    state_file = work_dir/".state.json"
+    if not args.force and is_up_to_date(src, manifest, state_file, state):
+        print(f"-- [{base}] up to date, skipping (--force to re-encode)")
+        return
+    # The old state must not outlive a failed run: the dash muxer rewrites manifest.mpd as it goes,
+    # so a stale state next to a fresh half-written manifest would look up to date
+    state_file.unlink(missing_ok=True)
+    ensure_dir(outdash)
+
+    print(f"=== [{base}] src={h_src}p GOP={gop} seg={args.seg}s ladder={ladder} ===")
+
+    # Split the cores between everything that encodes at once: --jobs workers, each running the
+    # H.264 and (if enabled) AV1 encoders concurrently, fused or not. Software encoders would
+    # otherwise each default to ~all cores and oversubscribe.
+    concurrent = max(1, args.jobs) * (1 if av1_enc == "none" else 2)
+    threads = max(1, (os.cpu_count() or 1) // concurrent)
+
+    # Per-title: shift the CRF tables by the content's complexity (runs before the encoders, so it
+    # gets the whole per-worker share of cores)
+    crf_shift = 0
+    analysed = True
+    if args.per_title:
+        try:
+            crf_shift = per_title_shift(src, work_dir/"per_title.vstats", max(1, (os.cpu_count() or 1) // max(1, args.jobs)))
+            print(f"-- [{base}] per-title CRF shift: {crf_shift:+d}")
+        except (RuntimeError, OSError) as e:
+            # no state saved: the next --per-title run retries instead of skipping this source
+            analysed = False
+            print(f"!! [{base}] per-title analysis failed, keeping default CRFs: {e}")
+
+    # Default path: one ffmpeg run encodes both ladders + audio and writes the DASH output directly
+    if packager == "ffmpeg":
+        audio_br = args.audio_bitrate if meta["has_audio"] else None
+        run(encode_dash(src, outdash, ladder, gop, args.seg, args.preset264, av1_enc, args.cpu_used, audio_br, threads, hw, crf_shift))
+        if analysed:
+            save_state(state_file, dict(state, crf_shift=crf_shift))
+        print(f"✔ Done: {manifest}")
+        return
+
+    v264_dir = work_dir/"h264"
+    vav1_dir = work_dir/"av1"
+    aud_dir  = work_dir/"audio"
+    ensure_dir(v264_dir); ensure_dir(vav1_dir); ensure_dir(aud_dir)
+
+    # Encode both ladders in one fused ffmpeg run (single decode + scale). With --no-fuse they run as
+    # concurrent ffmpeg processes instead; with a single worker each one is pinned to its own cores.
+    if av1_enc == "none":
+        cmds = [encode_h264(src, v264_dir, ladder, gop, args.seg, args.preset264, threads, hw, crf_shift)]
+    elif not args.no_fuse:
+        cmds = [encode_all(src, v264_dir, vav1_dir, ladder, gop, args.seg, args.preset264, av1_enc, args.cpu_used, threads, hw, crf_shift)]
+    else:
+        cmds = [encode_h264(src, v264_dir, ladder, gop, args.seg, args.preset264, threads, hw, crf_shift),
+                encode_av1(src, vav1_dir, ladder, gop, args.seg, av1_enc, args.cpu_used, threads, crf_shift)]
+    # Audio (optional) rides along as an extra output of the first run: the container is demuxed once
+    audio_path = aud_dir/"audio.m4a" if meta["has_audio"] else None
+    if audio_path:
+        cmds[0] += [*audio_opts(args.audio_bitrate), str(audio_path)]
+    cpu_sets = split_cpus(len(cmds)) if args.jobs <= 1 else [None] * len(cmds)
+    wait_all([run_async(cmd, cpus=cpus) for cmd, cpus in zip(cmds, cpu_sets)])
+
+    # Prepare lists for packaging
+    v264_files = [(h, v264_dir/f"h264_{h}.mp4") for h in ladder]
+    vav1_files = [(h, vav1_dir/f"av1_{h}.mp4") for h in ladder if (vav1_dir/f"av1_{h}.mp4").exists()]
+
+    # Package
+    if packager == "shaka":
+        package_shaka(outdash, args.seg, v264_files, vav1_files, audio_path)
+    else:
+        package_mp4box(outdash, args.seg, v264_files, vav1_files, audio_path)
+
+    if analysed:
+        save_state(state_file, dict(state, crf_shift=crf_shift))
+    print(f"✔ Done: {manifest}")
+
 # -------------------- Main --------------------
 def main():
     ap = argparse.ArgumentParser(description="Encode H.264+AV1 ladders for MP4 files and package to MPEG-DASH (CMAF).")
@@ -193,30 +719,58 @@ def main():
     ap.add_argument("--work","-w",default="temp", help="Work root for intermediate MP4s (default: ./temp)")
     ap.add_argument("--seg",type=int,default=4, help="Segment duration seconds (default: 4)")
     ap.add_argument("--audio-bitrate",default="192k", help="AAC bitrate (default: 192k)")
-    ap.add_argument("--preset264",default="slow", help="x264 preset (default: slow)")
+    ap.add_argument("--preset264",default=None, help="x264 preset for every rung (default: per rung, slow at 2160p .. faster at 480p)")
     ap.add_argument("--av1-encoder",choices=["auto","aom","svt"],default="auto", help="AV1 encoder (auto/aom/svt)")
-    ap.add_argument("--cpu-used",type=int,default=6, help="AV1 libaom cpu-used (0 best .. 8 fastest)")
+    ap.add_argument("--hw",choices=["auto","none","nvenc","qsv","vt"],default="auto", help="Hardware encoder backend for H.264 (and AV1 where available) (default: auto)")
+    ap.add_argument("--cpu-used",type=int,default=None, help="AV1 libaom cpu-used for every rung (0 best .. 8 fastest; default: per rung, 6 at 2160p .. 8 at 480p)")
     ap.add_argument("--max-height",type=int,default=0, help="Cap ladder to this height (e.g., 1440 to drop 2160p). 0 = no cap")
+    ap.add_argument("--packager",choices=["ffmpeg","external"],default="ffmpeg", help="DASH packaging: ffmpeg dash muxer during encode, or external Shaka/MP4Box pass (default: ffmpeg)")
+    ap.add_argument("--no-fuse",action="store_true", help="Encode H.264 and AV1 in separate concurrent ffmpeg runs instead of one (external packager only)")
+    ap.add_argument("--per-title",action="store_true", help="Shift CRFs per source from a quick complexity pre-analysis")
+    ap.add_argument("--force",action="store_true", help="Re-encode even if the output manifest is up to date")
+    ap.add_argument("--jobs","-j",type=int,default=1, help="Input files processed in parallel (default: 1)")
     args = ap.parse_args()
 
     input_dir = Path(args.input)
-    out_root  = Path(args.out)
-    work_root = Path(args.work)
 
     if not have("ffmpeg") or not have("ffprobe"):
         sys.exit("Error: ffmpeg and ffprobe are required in PATH.")
+    encoders = detect_encoders()
+    # build_filter() picks its scaler in the workers: probe the filter list once here, before --jobs
+    # starts them (forked workers inherit the memo, spawned ones read the disk cache)
+    has_filter("zscale")
+
+    # Pick packager: ffmpeg's dash muxer by default, Shaka/MP4Box only with --packager external
+    if args.packager == "external":
+        packager = "shaka" if have("packager") else ("mp4box" if have("MP4Box") else "")
+        if not packager:
+            sys.exit("Error: need Shaka Packager ('packager') or GPAC ('MP4Box') in PATH.")
+    else:
+        packager = "ffmpeg"
 
-    # Pick packager
-    packager = "shaka" if have("packager") else ("mp4box" if have("MP4Box") else "")
-    if not packager:
-        sys.exit("Error: need Shaka Packager ('packager') or GPAC ('MP4Box') in PATH.")
+    # Pick hardware backend: auto takes the first listed one whose H.264 encoder passes a test encode
+    # (tried in order, stopping at the first that works; --hw none tests nothing)
+    def works(name: Optional[str], listed: List[str]) -> bool:
+        return name in listed and hw_encoder_works(name)
 
-    # Pick AV1 encoder
+    if args.hw == "auto":
+        hw = next((b for b, e in HW_ENCODERS.items() if works(e["h264"], encoders.h264)), "none")
+    else:
+        hw = args.hw
+        if hw != "none" and not works(HW_ENCODERS[hw]["h264"], encoders.h264):
+            sys.exit(f"Error: {HW_ENCODERS[hw]['h264']} is not available/working in this ffmpeg.")
+    if hw == "none" and "libx264" not in encoders.h264:
+        sys.exit("Error: ffmpeg has no libx264 (use --hw to pick a hardware H.264 encoder).")
+    if hw != "none":
+        print(f"-- Hardware encoding: {hw}")
+
+    # Pick AV1 encoder (the hardware backend's own AV1 encoder first, when it has a working one)
     if args.av1_encoder == "auto":
-        encs = subprocess.run(["ffmpeg","-hide_banner","-encoders"], capture_output=True, text=True).stdout
-        if "libsvtav1" in encs:
+        if hw != "none" and works(HW_ENCODERS[hw]["av1"], encoders.av1):
+            av1_enc = hw
+        elif "libsvtav1" in encoders.av1:
             av1_enc = "svt"
-        elif "libaom-av1" in encs:
+        elif "libaom-av1" in encoders.av1:
             av1_enc = "aom"
         else:
             av1_enc = "none"
@@ -227,51 +781,23 @@ def main():
         print("!! AV1 encoder not found in ffmpeg (libsvtav1/libaom-av1). Proceeding with H.264 only.")
 
     # Collect files
-    files = sorted([p for p in input_dir.glob("*.mp4") if p.is_file()])
+    # scandir reuses the dirent type, so regular files cost no extra stat (only symlinks are followed)
+    files = []
+    if input_dir.is_dir():
+        with os.scandir(input_dir) as it:
+            files = sorted(Path(e.path) for e in it if e.name.lower().endswith(".mp4") and e.is_file())
     if not files:
         print(f"No .mp4 files found in: {input_dir}")
         return
 
     print(f"Found {len(files)} file(s) in: {input_dir}")
-    for src in files:
-        base = src.stem
-        gop = max(1, round(get_avg_fps(src)*2))
-        h_src = get_src_height(src)
-
-        # choose ladder entries
-        ladder = [h for h in DEFAULT_LADDER if h <= h_src and (args.max_height == 0 or h <= args.max_height)]
-        if not ladder:
-            ladder = [h_src]
-
-        work_dir = work_root/base
-        v264_dir = work_dir/"h264"
-        vav1_dir = work_dir/"av1"
-        aud_dir  = work_dir/"audio"
-        outdash  = out_root/base/"dash"
-        ensure_dir(v264_dir); ensure_dir(vav1_dir); ensure_dir(aud_dir); ensure_dir(outdash)
-
-        print(f"=== [{base}] src={h_src}p GOP={gop} seg={args.seg}s ladder={ladder} ===")
-
-        # Encode H.264 ladder (one ffmpeg run)
-        encode_h264(src, v264_dir, ladder, gop, args.preset264)
-        # Encode AV1 ladder if available
-        if av1_enc != "none":
-            encode_av1(src, vav1_dir, ladder, gop, av1_enc, args.cpu_used)
-
-        # Audio (optional)
-        audio_path = extract_audio(src, aud_dir/"audio.m4a", args.audio_bitrate)
-
-        # Prepare lists for packaging
-        v264_files = [(h, v264_dir/f"h264_{h}.mp4") for h in ladder]
-        vav1_files = [(h, vav1_dir/f"av1_{h}.mp4") for h in ladder if (vav1_dir/f"av1_{h}.mp4").exists()]
-
-        # Package
-        if packager == "shaka":
-            package_shaka(outdash, args.seg, v264_files, vav1_files, audio_path)
-        else:
-            package_mp4box(outdash, args.seg, v264_files, vav1_files, audio_path)
-
-        print(f"✔ Done: {outdash/'manifest.mpd'}")
+    jobs = max(1, args.jobs)
+    if jobs == 1:
+        for src in files:
+            process_one(src, args, packager, av1_enc, hw)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            list(ex.map(partial(process_one, args=args, packager=packager, av1_enc=av1_enc, hw=hw), files))
 
     print("\nAll set! Server MIME: .mpd=application/dash+xml  .m4s=video/iso.segment")
 